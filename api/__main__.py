@@ -17,6 +17,9 @@ def _main() -> None:
     entry_point.add_command(
         scripts.prepare_data,
     )
+    entry_point.add_command(
+        scripts.prepare_stocks,
+    )
 
     entry_point()
 
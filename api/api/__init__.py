@@ -1,16 +1,16 @@
 """Main API module that is used as entrypoint for deployment."""
 
-from fastapi import FastAPI
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header
 from fastapi.responses import HTMLResponse, PlainTextResponse
 
-from .stock_api import calculate_gains
+from .stock_api import calculate_gains, load_data
 
-app = FastAPI(title="S&P 500 Stock API")
 
-@app.get("/", response_class=HTMLResponse)
-async def root() -> str:
-    """Return an informative HTML page about the Stock Prices Gains Analysis API."""
-    return """
+# Informative HTML page about the API, served at the root
+_ROOT_HTML = """
     <html>
         <head>
             <title>S&P 500 Stock Prices Gains Analysis API</title>
@@ -42,19 +42,35 @@ async def root() -> str:
             <p>For more details, check the <a href="/docs">API documentation</a>.</p>
         </body>
     </html>
-    """
+"""
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:  # noqa: ARG001
+    """Load the price lookup at startup, so that no request has to wait for it and the API fails
+    to start when the prepared stock data is missing.
+    """  # noqa: D205
+    load_data()
+    yield
+
+
+app = FastAPI(title="S&P 500 Stock API", lifespan=lifespan)
+
+@app.get("/", response_class=HTMLResponse)
+async def root() -> HTMLResponse:
+    """Return an informative HTML page about the Stock Prices Gains Analysis API."""
+    return HTMLResponse(_ROOT_HTML)
 
 @app.get("/ex2/gains", response_class=HTMLResponse)
-async def gains(name: str, starting_date: str, end_date: str, investment: float):
+async def gains(
+    name: str,
+    starting_date: str,
+    end_date: str,
+    investment: float,
+    if_none_match: str | None = Header(None),
+):
     """Calculate gains for a company in a given period."""
-    return await calculate_gains(name, starting_date, end_date, investment)
-@app.get("/", response_class=PlainTextResponse)
-async def root() -> str:  # noqa: F811
-    """Return a simple welcome message.
-
-    :return: A simple welcome message.
-    """
-    return "Welcome to Alexion MLOps Test API!"
+    return await calculate_gains(name, starting_date, end_date, investment, if_none_match)
 
 
 @app.get("/ex0")
@@ -3,28 +3,74 @@ import logging
 from pathlib import Path
 from typing import NoReturn
 
+import numpy as np
 import polars as pl
 from fastapi import HTTPException
-from sklearn.impute import KNNImputer
-from sklearn.preprocessing import StandardScaler
+
+from .. import SEED
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-def prepare_data(file_path: str) -> pl.DataFrame:
+def knn_impute(data: pl.DataFrame, columns: list[str], *, fit_size: int = 1000) -> pl.DataFrame:
+    """Impute missing values of the given columns with scikit-learn's KNNImputer.
+
+    A single imputer is fitted on a random sample of the numeric block and applied to all of it,
+    so that the neighbour search grows linearly with the number of rows instead of
+    quadratically. When scikit-learn-intelex is installed, scikit-learn is patched with its
+    accelerated implementations before the imputer is imported.
+
+    Parameters
+    ----------
+        - data (pl.DataFrame): Data with missing values.
+        - columns (list[str]): Numeric columns to impute.
+        - fit_size (int): Maximum number of rows the imputer is fitted on.
+
+    Returns
+    -------
+        - pl.DataFrame: The data with the given columns imputed.
+
+    """
+    try:
+        from sklearnex import patch_sklearn
+    except ImportError:
+        logging.info("scikit-learn-intelex is not installed, using scikit-learn KNNImputer")
+    else:
+        patch_sklearn()
+
+    # Imported after patching, so that the accelerated implementation is picked up
+    from sklearn.impute import KNNImputer
+
+    numeric_data = data.select(columns).to_numpy()
+    fit_rows = np.random.default_rng(SEED).choice(
+        len(numeric_data), size=min(fit_size, len(numeric_data)), replace=False
+    )
+    imputer = KNNImputer(n_neighbors=5).fit(numeric_data[fit_rows])
+    imputed_data = imputer.transform(numeric_data)
+    return data.with_columns(pl.DataFrame(imputed_data, schema=columns))
+
+def prepare_data(file_path: str, *, knn_imputation: bool = False) -> pl.DataFrame:
     """Prepare the customer data for analysis. This function performs the following steps:
         
         1. Constructs the absolute path to the CSV file based on the provided `file_path`.
         2. Checks if the file exists, raising a `FileNotFoundError` if it does not.
-        3. Loads the dataset from the CSV file into a Polars DataFrame.
-        4. Converts the 'date' column to datetime format.
-        5. Checks for and logs any missing values in the dataset.
-        6. Identifies numeric columns for imputation.
-        7. Sorts the DataFrame by stock name and date.
-        8. Applies KNN imputation to the numeric columns, grouped by stock name.
-        9. Checks and logs any remaining missing values after imputation.
-        10. Scales the numeric columns using StandardScaler.
-        11. Returns the transformed DataFrame grouped by stock name.
+        3. Lazily scans the CSV file, parsing the 'date' column as a date, prices as Float32 and
+           volumes as UInt32 while reading.
+        4. Keeps only the stock name, date and numeric columns, sorted by stock name and date.
+        5. Fills missing numeric values forward, then backward, within each stock name
+           (or applies KNN imputation over all stocks when `knn_imputation` is set).
+        6. Standardizes the numeric columns within each stock name, like StandardScaler, keeping
+           them as Float32.
+        7. Collects the whole plan with the streaming engine, together with the missing value
+           counts of the raw data, which are logged.
+        8. Checks and logs any remaining missing values after imputation.
+        9. Returns the transformed DataFrame sorted by stock name and date.
+
+    Parameters
+    ----------
+        - file_path (str): Path to the CSV file, relative to this module.
+        - knn_imputation (bool): Use scikit-learn's KNNImputer instead of the forward/backward
+          fill. It is orders of magnitude slower and only kept for comparison purposes.
                
     Returns
     -------
@@ -52,51 +98,69 @@ def prepare_data(file_path: str) -> pl.DataFrame:
         if not absolute_file_path.exists():
             raise_file_not_found_error()
 
-        # Load the dataset
-        customer_data  = pl.read_csv(absolute_file_path)
-
-        # Convert 'date' column to datetime
-        customer_data = customer_data.with_columns(pl.col("date").str.to_datetime("%Y-%m-%d"))
-
-        # Check for missing values
-        missing_counts = customer_data.null_count()
-        logging.info("Missing value counts:")
-        logging.info(missing_counts)
-
         # Identify numeric columns for imputation
         numeric_columns = ["open", "high", "low", "close", "volume"]
 
-        # Sort the dataframe by date and name
-        customer_data = customer_data.sort(["Name", "date"])
-
-        # Perform KNN imputation on numeric columns
-        imputer = KNNImputer(n_neighbors=5)
-
-        # Group by stock name and apply imputation
-        def impute_group(group: pl.DataFrame)-> pl.DataFrame:
-            numeric_data = group.select(numeric_columns).to_numpy()
-            imputed_data = imputer.fit_transform(numeric_data)
-            imputed_df = pl.DataFrame(imputed_data, schema=numeric_columns)
-            return group.with_columns(imputed_df)
-
-        customer_data = customer_data.group_by("Name").map_groups(impute_group)
+        # Lazily scan the dataset, parsing dates in the CSV reader, keeping only the used columns
+        # and sorting it by name and date. Prices fit in single precision and daily volumes in
+        # 32 bits, which halves the bytes moved by every later step
+        raw_data = (
+            pl.scan_csv(
+                absolute_file_path,
+                schema_overrides={
+                    "date": pl.Date,
+                    "open": pl.Float32,
+                    "high": pl.Float32,
+                    "low": pl.Float32,
+                    "close": pl.Float32,
+                    "volume": pl.UInt32,
+                },
+            )
+            .select(["Name", "date", *numeric_columns])
+            .sort(["Name", "date"])
+            # Flag the sort order so that window and filter operations on the name can use it;
+            # dates are only sorted within each name, so they cannot be flagged
+            .with_columns(pl.col("Name").set_sorted())
+        )
+
+        if knn_imputation:
+            # Perform KNN imputation on numeric columns
+            imputed_data = knn_impute(raw_data.collect(), numeric_columns).lazy()
+        else:
+            # Fill gaps with the closest previous (or next) quote of the same stock
+            imputed_data = raw_data.with_columns(
+                [pl.col(c).forward_fill().backward_fill().over("Name") for c in numeric_columns]
+            )
+
+        # Standardize numeric columns per stock name (population std, as StandardScaler does).
+        # Like StandardScaler, constant columns are centered only, to 0 instead of 0 / 0 = NaN
+        prepared_data = imputed_data.with_columns(
+            [
+                pl.when(pl.col(c).std(ddof=0).over("Name") == 0)
+                .then(0.0)
+                .otherwise(
+                    (pl.col(c) - pl.col(c).mean().over("Name"))
+                    / pl.col(c).std(ddof=0).over("Name")
+                )
+                .cast(pl.Float32)
+                .alias(c)
+                for c in numeric_columns
+            ]
+        )
+
+        # Run the whole plan at once, sharing the scan with the missing values check
+        missing_counts, customer_data = pl.collect_all(
+            [raw_data.null_count(), prepared_data], engine="streaming"
+        )
+        logging.info("Missing value counts:")
+        logging.info(missing_counts)
 
         # Check for any remaining missing values
         remaining_missing = customer_data.null_count()
         logging.info("\nRemaining missing value counts after imputation:")
         logging.info(remaining_missing)
 
-        # Scale the numeric data
-        scaler = StandardScaler()
-
-        # Apply scaling to numeric columns
-        def scale_group(group: pl.DataFrame)-> pl.DataFrame:
-            numeric_data = group.select(numeric_columns).to_numpy()
-            scaled_data = scaler.fit_transform(numeric_data)
-            scaled_df = pl.DataFrame(scaled_data, schema=numeric_columns)
-            return group.with_columns(scaled_df)
-
-        return customer_data.group_by("Name").map_groups(scale_group)
+        return customer_data
 
     except Exception as e:
         # Log the error (you might want to use a proper logging system here)
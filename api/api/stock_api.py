@@ -1,32 +1,99 @@
 
+import hashlib
 import logging
-from datetime import datetime
+import re
+from dataclasses import dataclass
+from datetime import date
 from functools import lru_cache
-from pathlib import Path
 from typing import NoReturn
 
+import numpy as np
 import polars as pl
-from fastapi import HTTPException, Query
-from fastapi.responses import HTMLResponse
+from fastapi import Header, HTTPException, Query
+from fastapi.responses import HTMLResponse, Response
 
-from .data_preparation import prepare_data
+from .. import DATA_DIR
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Get the path to the project root
-project_root = Path(__file__).resolve().parent.parent.parent
+# Stock data prepared offline by the ``prepare-stocks`` command
+prepared_file = DATA_DIR / "all_stocks_5yr.prepared.parquet"
+
+# Dates accepted by the API, as ``date.fromisoformat`` also accepts other ISO 8601 formats
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# HTML page of the gains analysis, rendered with ``str.format_map``
+_GAINS_HTML = """
+    <html>
+        <head>
+            <title>Stock Gains Analysis</title>
+            <style>
+                body {{ font-family: Arial, sans-serif; line-height: 1.6; padding: 20px; }}
+                h1 {{ color: #333; }}
+                table {{ border-collapse: collapse; width: 100%; }}
+                th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
+                th {{ background-color: #f2f2f2; }}
+                .positive {{ color: green; }}
+                .negative {{ color: red; }}
+            </style>
+        </head>
+        <body>
+            <h1>Stock Gains Analysis</h1>
+            <table>
+                <tr><th>Company</th><td>{name}</td></tr>
+                <tr><th>Starting Date</th><td>{start_date:%Y-%m-%d}</td></tr>
+                <tr><th>End Date</th><td>{end_date:%Y-%m-%d}</td></tr>
+                <tr><th>Initial Investment</th><td>${investment:,.2f}</td></tr>
+                <tr><th>Starting Price</th><td>${start_price:.2f}</td></tr>
+                <tr><th>Ending Price</th><td>${end_price:.2f}</td></tr>
+                <tr><th>Gains/Losses</th><td class="{gains_class}">${gains:,.2f}</td></tr>
+                <tr><th>Percent Change</th><td class="{percent_change_class}">{percent_change:.2f}%</td></tr>
+                <tr><th>Final Value</th><td>${final_value:,.2f}</td></tr>
+            </table>
+        </body>
+    </html>
+    """
+
+@dataclass(frozen=True)
+class CompanyPrices:
+    """Daily prices of a company, as parallel arrays sorted by date.
+
+    :param dates: Trading days.
+    :param open: Opening price of each trading day.
+    :param close: Closing price of each trading day.
+    """
+
+    dates: np.ndarray
+    open: np.ndarray
+    close: np.ndarray
 
 @lru_cache(maxsize=1)
-def load_data() -> pl.DataFrame:
-    """Load and prepare stock data from a CSV file."""
+def load_data() -> dict[str, CompanyPrices]:
+    """Load stock data prepared offline into a price lookup by company name.
+
+    :raises FileNotFoundError: When the prepared data has not been built.
+    """
+    if not prepared_file.exists():
+        raise FileNotFoundError(
+            f"Prepared stock data {prepared_file} does not exist. Build it with "
+            "`alxn-test prepare-stocks`."
+        )
+
     try:
-        file_path = project_root / "data" / "all_stocks_5yr.csv"
-        logger.info("Attempting to load data from %s", file_path)
-        prepared_df = prepare_data(file_path)
+        # Data is prepared sorted by name and date, so no sort is needed
+        prices_df = pl.read_parquet(prepared_file, columns=["Name", "date", "open", "close"])
+        prices = {
+            name: CompanyPrices(
+                dates=company_df["date"].to_numpy(),
+                open=company_df["open"].to_numpy(),
+                close=company_df["close"].to_numpy(),
+            )
+            for (name,), company_df in prices_df.partition_by("Name", as_dict=True).items()
+        }
         logger.info("Data loaded successfully")
-        return prepared_df
+        return prices
     except Exception as e:
         logger.exception("Error loading data")
         raise HTTPException(
@@ -34,17 +101,81 @@ def load_data() -> pl.DataFrame:
             detail="Internal server error while loading data."
         ) from e
 
+def parse_date(value: str) -> date:
+    """Parse a date in the YYYY-MM-DD format.
+
+    :raises ValueError: When the value is not a valid date in the YYYY-MM-DD format.
+    """
+    if not _DATE_PATTERN.fullmatch(value):
+        raise ValueError(f"{value!r} is not in the YYYY-MM-DD format")
+    return date.fromisoformat(value)
+
 def raise_http_exception(status_code: int, detail: str) -> NoReturn:
     """Raise an HTTPException with the given status code and detail."""
     logger.error(detail)
     raise HTTPException(status_code=status_code, detail=detail)
 
+@lru_cache(maxsize=10_000)
+def _compute_gains(
+    name: str, start_date: date, end_date: date, investment: float
+) -> tuple[str, str]:
+    """Compute the gains of a company's stock over a validated date range and render them as an
+    HTML page, along with its ETag.
+
+    Results are memoized, as they only depend on the arguments and the data is static.
+    """  # noqa: D205
+    # Look up the prices of the specified company
+    prices = load_data().get(name)
+    if prices is None:
+        raise_http_exception(404, "No data found for the specified company and date range.")
+
+    # Find the first and last trading days of the date range, which tolerates weekends and
+    # holidays at the range boundaries
+    first = np.searchsorted(prices.dates, np.datetime64(start_date), side="left")
+    last = np.searchsorted(prices.dates, np.datetime64(end_date), side="right") - 1
+
+    if first > last:
+        raise_http_exception(404, "No data found for the specified company and date range.")
+
+    # Get the opening price on the first trading day and the closing price on the last one
+    start_price = float(prices.open[first])
+    end_price = float(prices.close[last])
+
+
+    # Calculate gains
+    # Gains are computed the following way: (close in end_date / open in starting_date) * investment
+    gains = (end_price / start_price) * investment
+
+    percent_change = ((end_price - start_price) / start_price) * 100
+
+    logger.info("Calculation successful. Gains: %s", gains)
+
+    # Format the response as HTML
+    html_content = _GAINS_HTML.format_map(
+        {
+            "name": name,
+            "start_date": start_date,
+            "end_date": end_date,
+            "investment": investment,
+            "start_price": start_price,
+            "end_price": end_price,
+            "gains": gains,
+            "gains_class": "positive" if gains >= 0 else "negative",
+            "percent_change": percent_change,
+            "percent_change_class": "positive" if percent_change >= 0 else "negative",
+            "final_value": investment + gains,
+        }
+    )
+    etag = f'"{hashlib.md5(html_content.encode(), usedforsecurity=False).hexdigest()}"'
+    return html_content, etag
+
 async def calculate_gains(
     name: str = Query(..., description="Company identifier"),
     starting_date: str = Query(..., description="Starting date (YYYY-MM-DD)"),
     end_date: str = Query(..., description="End date (YYYY-MM-DD)"),
     investment: float = Query(..., gt=0, description="Amount invested at starting date"),
-) -> HTMLResponse:
+    if_none_match: str | None = Header(None, description="ETags of the cached pages"),
+) -> Response:
     """Calculate gains from stock investments over a specified date range.
 
         This function calculates the gains from a stock investment based on the specified
@@ -57,10 +188,12 @@ async def calculate_gains(
         - starting_date (str): The starting date for the calculation (YYYY-MM-DD).
         - end_date (str): The end date for the calculation (YYYY-MM-DD).
         - investment (float): The amount invested at the starting date (must be greater than 0).
+        - if_none_match (str | None): ETags of the pages already cached by the client.
 
     Returns
     -------
-        - HTMLResponse: An HTML response containing the stock gains analysis.
+        - Response: An HTML response containing the stock gains analysis, or an empty 304
+          response when the client already has it.
 
     Raises
     ------
@@ -75,79 +208,25 @@ async def calculate_gains(
         
         # Validate input dates
         try:
-            start_date = datetime.strptime(starting_date, "%Y-%m-%d")
-            end_date = datetime.strptime(end_date, "%Y-%m-%d")
+            start_date = parse_date(starting_date)
+            end_date = parse_date(end_date)
         except ValueError as ve:
             raise_http_exception(400, f"Invalid date format. Use YYYY-MM-DD. Error: {ve}")
 
         if start_date >= end_date:
             raise_http_exception(400, "Start date must be before end date.")
         
-        # Load the data
-        prepared_df = load_data()
-
-        # Filter data for the specified company and date range
-        company_data = prepared_df.filter(
-            (pl.col("Name") == name) & (pl.col("date") >= start_date) & (pl.col("date") <= end_date)
-        )
-
-        if company_data.is_empty():
-            raise_http_exception(404, "No data found for the specified company and date range.")
+        # Identical queries are served from the cache of rendered responses
+        html_content, etag = _compute_gains(name, start_date, end_date, investment)
+        headers = {"Cache-Control": "public, max-age=86400", "ETag": etag}
 
-        # Get the opening price on the starting date and closing price on the end date
-        start_price_data = company_data.filter(pl.col("date") == start_date)
-        end_price_data = company_data.filter(pl.col("date") == end_date)
+        # Clients that already have the page revalidate it without downloading it again
+        if if_none_match is not None:
+            client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if etag in client_etags or "*" in client_etags:
+                return Response(status_code=304, headers=headers)
 
-        if start_price_data.is_empty() or end_price_data.is_empty():
-            raise_http_exception(404, "No data found for the specified dates.")
-
-        start_price = start_price_data["open"].item()
-        end_price = end_price_data["close"].item()
-
-
-        # Calculate gains
-        # Gains are computed the following way: (close in end_date / open in starting_date) * investment
-        gains = (end_price / start_price) * investment
-        
-        percent_change = ((end_price - start_price) / start_price) * 100
-        
-        logger.info("Calculation successful. Gains: %s", gains)
-
-        # Format the response as HTML
-        html_content = f"""
-        <html>
-            <head>
-                <title>Stock Gains Analysis</title>
-                <style>
-                    body {{ font-family: Arial, sans-serif; line-height: 1.6; padding: 20px; }}
-                    h1 {{ color: #333; }}
-                    table {{ border-collapse: collapse; width: 100%; }}
-                    th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                    th {{ background-color: #f2f2f2; }}
-                    .positive {{ color: green; }}
-                    .negative {{ color: red; }}
-                </style>
-            </head>
-            <body>
-                <h1>Stock Gains Analysis</h1>
-                <table>
-                    <tr><th>Company</th><td>{name}</td></tr>
-                    <tr><th>Starting Date</th><td>{starting_date}</td></tr>
-                    <tr><th>End Date</th><td>{end_date}</td></tr>
-                    <tr><th>Initial Investment</th><td>${investment:,.2f}</td></tr>
-                    <tr><th>Starting Price</th><td>${start_price:.2f}</td></tr>
-                    <tr><th>Ending Price</th><td>${end_price:.2f}</td></tr>
-                    <tr><th>Gains/Losses</th><td class="{'positive' if gains >= 0 
-                    else 'negative'}">${gains:,.2f}</td></tr>
-                    <tr><th>Percent Change</th><td class="{'positive' if percent_change >= 0 
-                    else 'negative'}">{percent_change:.2f}%</td></tr>
-                    <tr><th>Final Value</th><td>${(investment + gains):,.2f}</td></tr>
-                </table>
-            </body>
-        </html>
-        """
-
-        return HTMLResponse(content=html_content, status_code=200)
+        return HTMLResponse(content=html_content, headers=headers)
     
     except HTTPException:
         raise
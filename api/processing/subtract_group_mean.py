@@ -1,41 +1,371 @@
 """Function to subtract the mean of each group for a given column to each of the rows of said
 column."""
 
+from collections.abc import Callable
+from functools import lru_cache
+from typing import TypeVar
+
+import numpy as np
 import polars as pl
-from polars import DataFrame
+from polars import DataFrame, LazyFrame
+
+try:
+    from numba import get_num_threads, njit, prange
+except ImportError:  # numba is an optional accelerator, installed with the ``numba`` extra
+    njit = None
+
+FrameT = TypeVar("FrameT", DataFrame, LazyFrame)
+
+# Size from which DataFrames are collected with the streaming engine by default
+_STREAMING_MIN_BYTES = 1 << 30
+
+# Number of enum categories up to which large unsorted DataFrames are processed by an array kernel
+_KERNEL_MAX_GROUPS = 1000
 
+# Number of rows under which frames are processed by the single-threaded NumPy kernel, as
+# dispatching work to a thread pool costs more than the computation itself
+_SMALL_FRAME_ROWS = 100_000
 
-def subtract_group_mean(df: DataFrame, group_col: str, val_col: str) -> DataFrame:  # noqa: D417
+
+def subtract_group_mean(  # noqa: D417
+    df: FrameT,
+    group_col: str,
+    val_col: str,
+    *,
+    dtype: pl.DataType | type[pl.DataType] = pl.Float64,
+    keep_mean: bool = True,
+    streaming: bool | None = None,
+) -> FrameT:
     """Polars offers significant advantages in terms of performance, efficiency,
     and modern data processing features. 
     Its ability to handle large datasets efficiently and execute operations 
     in parallel makes it a strong choice for data-intensive applications.
 
-    We can greatly simplify the original function by eliminating the loops and using built-in 
-    polars methods like groupby and transform to handle group operations more efficiently.
+    We can greatly simplify the original function by eliminating the loops and using a polars
+    window expression, which computes the mean of each group inline without a join.
 
     Subtracts the mean of each group for a given column from each row of that column.
-    Adds a new column with the mean of each group.
+    Adds a new column with the mean of each group, right before the value column.
+
+    The transformation is built as a single lazy query, so that Polars optimizes it as a whole.
+    A DataFrame is only collected at the end, while a LazyFrame is returned as a LazyFrame to
+    be collected by the caller along with the rest of its query.
 
     Parameters
     ----------
-        df (pl.DataFrame): The Polars DataFrame containing the data.
+        df (pl.DataFrame | pl.LazyFrame): The Polars DataFrame or LazyFrame containing the data.
         group_col (str): The column name to group by.
         val_col (str): The column name whose group mean is to be subtracted.
+        dtype (pl.DataType): Float type the values are cast to before computing the means.
+            ``pl.Float32`` halves the memory moved through the reduction on large frames, at the
+            cost of precision.
+        keep_mean (bool): Whether to add the group mean column. When only the adjusted values
+            are needed, leaving it out avoids allocating and writing a column as long as the data.
+        streaming (bool | None): Whether to collect a DataFrame with the streaming engine, which
+            processes the data in chunks and can handle frames larger than memory. By default it
+            is used for DataFrames above 1 GiB. When used, the array kernels are skipped.
+            Ignored for LazyFrames, which the caller collects.
 
     Returns:
     -------
-        pl.DataFrame: The DataFrame with the adjusted values and the group mean column.
+        pl.DataFrame | pl.LazyFrame: The DataFrame (or LazyFrame, if given one) with the
+        adjusted values and, unless ``keep_mean`` is False, the group mean column.
+
+    Raises:
+    ------
+        ValueError: If ``dtype`` is not a float type.
     """  # noqa: D413, D406, D202
+    if not dtype.is_float():
+        raise ValueError(f"dtype must be a float type, got {dtype}")
+
+    if streaming is None and isinstance(df, DataFrame):
+        streaming = df.estimated_size() >= _STREAMING_MIN_BYTES
+
+    # Small frames, and numeric values split in a few enum groups or sorted by group, are processed
+    # faster by an array kernel than by the generic window machinery, which has to maintain a hash
+    # table and dispatch work to a thread pool. Frames collected with the streaming engine skip
+    # the kernels, which need the whole data in memory
+    if (
+        isinstance(df, DataFrame)
+        and not streaming
+        and (codes := _kernel_codes(df, group_col, val_col)) is not None
+    ):
+        return _subtract_group_mean_kernel(
+            df, *codes, group_col, val_col, dtype=dtype, keep_mean=keep_mean
+        )
+
+    lf = df.lazy()
+
+    # Plans are only built once for each input schema and set of parameters
+    plan = _build_plan(
+        tuple(lf.collect_schema().names()), group_col, val_col, dtype, keep_mean=keep_mean
+    )
+    lf = plan(lf)
+
+    # Only materialize the result when the caller gave an eager DataFrame
+    if isinstance(df, LazyFrame):
+        return lf
+
+    return lf.collect(engine="streaming" if streaming else "auto")
+
+
+def subtract_group_mean_arrays(
+    group_codes: np.ndarray, vals: np.ndarray, *, sorted_codes: bool | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Subtract the mean of each group from the values of its rows, on plain NumPy arrays.
+
+    This is the kernel behind ``subtract_group_mean`` for DataFrames, exposed for hot loops that
+    already hold contiguous buffers and would otherwise pay for building Series and DataFrames
+    on each call. Unsorted codes are reduced by the compiled numba kernel when numba is installed,
+    except for small arrays, which are reduced by NumPy in a single thread.
+
+    Parameters
+    ----------
+        group_codes (np.ndarray): Non-negative integer group code of each row. Buffers as long
+            as the largest code are allocated, so codes should be dense.
+        vals (np.ndarray): Value of each row. A NaN makes the mean of its group NaN. Values
+            that are not floats are cast to float64.
+        sorted_codes (bool | None): Whether the codes are sorted in ascending order, in which
+            case groups are reduced as contiguous segments. By default it is checked on the codes.
+
+    Returns:
+    -------
+        tuple[np.ndarray, np.ndarray]: Mean of each group code, zero for unused codes, and value
+        of each row minus the mean of its group, in the dtype of ``vals`` if it is a float one.
+    """  # noqa: D413, D406
+    # Residuals are written in the dtype of the values, which must hold fractional means
+    if not np.issubdtype(vals.dtype, np.floating):
+        vals = vals.astype(np.float64)
+
+    if len(group_codes) == 0:
+        return np.zeros(0), np.empty_like(vals)
+
+    if sorted_codes is None:
+        sorted_codes = bool(np.all(group_codes[:-1] <= group_codes[1:]))
+
+    if sorted_codes:
+        return _subtract_group_mean_sorted(group_codes, vals)
+
+    n_groups = int(group_codes.max()) + 1
+    if njit is not None and len(group_codes) >= _SMALL_FRAME_ROWS:
+        return _subtract_group_mean_numba(group_codes, vals, n_groups, get_num_threads())
+    return _subtract_group_mean_bincount(group_codes, vals, n_groups)
+
+
+@lru_cache(maxsize=64)
+def _build_plan(
+    columns: tuple[str, ...],
+    group_col: str,
+    val_col: str,
+    dtype: pl.DataType | type[pl.DataType],
+    *,
+    keep_mean: bool,
+) -> Callable[[LazyFrame], LazyFrame]:
+    """Build the query subtracting the group mean for inputs with the given columns.
+
+    :param columns: Column names of the input, in order.
+    :param group_col: The column name to group by.
+    :param val_col: The column name whose group mean is to be subtracted.
+    :param dtype: Float type the values are cast to before computing the means.
+    :param keep_mean: Whether to add the group mean column.
+    :return: Function applying the query to a LazyFrame with the given columns.
+    :raises ColumnNotFoundError: When the value column is not one of the input columns.
+    """
+    if val_col not in columns:
+        raise pl.exceptions.ColumnNotFoundError(val_col)
 
     mean_col = f"{val_col}_mean_by_{group_col}"
 
-    # Use group_by (instead of groupby) to compute group means
-    group_means = df.group_by(group_col).agg( pl.col(val_col).mean().alias(mean_col) )
+    # Broadcast the mean of each group to its rows with a window expression, materialized once
+    # as a named column. Subtracting the column by name, rather than repeating the window
+    # expression, does not rely on the optimizer eliminating the common subexpression
+    value = pl.col(val_col).cast(dtype)
+    group_mean = value.mean().over(group_col).alias(mean_col)
+    adjusted_value = (value - pl.col(mean_col)).alias(val_col)
+
+    # Lay out the group mean column right before the value column, or drop it
+    output_columns = [col for col in columns if col != mean_col]
+    val_idx = output_columns.index(val_col)
+    output_columns[val_idx:val_idx] = [mean_col] if keep_mean else []
+
+    def plan(lf: LazyFrame) -> LazyFrame:
+        return lf.with_columns(group_mean).with_columns(adjusted_value).select(output_columns)
+
+    return plan
+
+
+def _kernel_codes(
+    df: DataFrame, group_col: str, val_col: str
+) -> tuple[np.ndarray, bool] | None:
+    """Get the integer codes of the groups if an array kernel can process the data.
+
+    The kernels need numeric values and no missing values. Groups flagged as sorted are numbered
+    by run, whatever their type, and processed as contiguous segments. Otherwise, the groups must
+    be strings, categoricals or enums. Enum groups already hold dense codes, which are worth using
+    with less than ``_KERNEL_MAX_GROUPS`` categories, and less than the square root of the number
+    of rows, so that the per-group buffers stay small next to the data. Other groups have to be
+    numbered first, which is only worth it for frames with less than ``_SMALL_FRAME_ROWS`` rows.
+
+    :param df: The Polars DataFrame containing the data.
+    :param group_col: The column name to group by.
+    :param val_col: The column name whose group mean is to be subtracted.
+    :return: Group code of each row and whether the codes are sorted, or None if the kernels
+        cannot process the data.
+    """
+    groups = df[group_col]
+    values = df[val_col]
+
+    if df.is_empty() or not values.dtype.is_numeric() or groups.null_count() or values.null_count():
+        return None
+
+    if groups.flags["SORTED_ASC"] or groups.flags["SORTED_DESC"]:
+        return groups.rle_id().to_numpy(), True
+
+    if not (groups.dtype in (pl.String, pl.Categorical) or isinstance(groups.dtype, pl.Enum)):
+        return None
+
+    if isinstance(groups.dtype, pl.Enum):
+        n_groups = len(groups.dtype.categories)
+        if n_groups < _KERNEL_MAX_GROUPS and n_groups**2 < len(groups):
+            return groups.to_physical().to_numpy(), False
+
+    # On larger frames, numbering the groups takes about as long as the whole window query
+    if len(groups) >= _SMALL_FRAME_ROWS:
+        return None
+
+    # Number the groups of this frame densely through an Enum of its own values. Categorical
+    # codes are shared by the whole process, so they can be far larger than the number of groups
+    categories = groups.unique().cast(pl.String)
+    return groups.cast(pl.Enum(categories)).to_physical().to_numpy(), False
+
+
+def _subtract_group_mean_kernel(
+    df: DataFrame,
+    codes: np.ndarray,
+    sorted_codes: bool,
+    group_col: str,
+    val_col: str,
+    *,
+    dtype: pl.DataType | type[pl.DataType],
+    keep_mean: bool,
+) -> DataFrame:
+    """Subtract the group mean with an array kernel, laying out the output columns as the Polars
+    query does.
+
+    :param df: The Polars DataFrame containing the data.
+    :param codes: Group code of each row.
+    :param sorted_codes: Whether the codes are sorted.
+    :param group_col: The column name to group by.
+    :param val_col: The column name whose group mean is to be subtracted.
+    :param dtype: Float type the values are cast to before computing the means.
+    :param keep_mean: Whether to add the group mean column.
+    :return: The DataFrame with the adjusted values and, optionally, the group mean column.
+    """  # noqa: D205
+    mean_col = f"{val_col}_mean_by_{group_col}"
+
+    vals = df[val_col].cast(dtype).to_numpy()
+    means, residuals = subtract_group_mean_arrays(codes, vals, sorted_codes=sorted_codes)
+
+    # Series wrap the NumPy arrays without copying them, and so does the projection, so the
+    # output columns are only written once, by the kernel and the gather of the means
+    output_columns = [col for col in df.columns if col != mean_col]
+    val_idx = output_columns.index(val_col)
+    mean_series = (
+        [pl.Series(mean_col, means.astype(residuals.dtype, copy=False)[codes])] if keep_mean else []
+    )
+    return df.select(
+        *output_columns[:val_idx],
+        *mean_series,
+        pl.Series(val_col, residuals),
+        *output_columns[val_idx + 1:],
+    )
+
+
+def _subtract_group_mean_bincount(
+    codes: np.ndarray, vals: np.ndarray, n_groups: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the mean of each group and subtract it from the values of its rows.
+
+    Sums and counts are accumulated with ``np.bincount``, in a single contiguous pass over the
+    codes and values and without any hashing.
+
+    :param codes: Group code of each row, lower than ``n_groups``.
+    :param vals: Value of each row.
+    :param n_groups: Number of group codes.
+    :return: Mean of each group code and value of each row minus the mean of its group.
+    """
+    sums = np.bincount(codes, weights=vals, minlength=n_groups)
+    counts = np.bincount(codes, minlength=n_groups)
+    means = np.divide(sums, counts, out=np.zeros(n_groups), where=counts > 0)
+
+    # Broadcast the means in the dtype of the values and subtract them in place, so that a single
+    # array as long as the data is allocated
+    residuals = means.astype(vals.dtype, copy=False)[codes]
+    np.subtract(vals, residuals, out=residuals)
+    return means, residuals
+
+
+def _subtract_group_mean_sorted(
+    codes: np.ndarray, vals: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the mean of each group and subtract it from the values of its rows.
+
+    Each group is a contiguous segment of the sorted codes, reduced with ``np.add.reduceat`` in a
+    sequential pass.
+
+    :param codes: Sorted group code of each row.
+    :param vals: Value of each row.
+    :return: Mean of each group code and value of each row minus the mean of its group.
+    """
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    lengths = np.diff(starts, append=len(codes))
+    segment_means = np.add.reduceat(vals, starts, dtype=np.float64) / lengths
+
+    means = np.zeros(int(codes[-1]) + 1)
+    means[codes[starts]] = segment_means
+    residuals = np.repeat(segment_means.astype(vals.dtype, copy=False), lengths)
+    np.subtract(vals, residuals, out=residuals)
+    return means, residuals
+
+
+if njit is not None:
+
+    # Only reassociation and contraction are allowed, so that the sums vectorize while NaN and
+    # infinite values still propagate to the means of their groups
+    @njit(parallel=True, fastmath={"reassoc", "contract"}, cache=True)
+    def _subtract_group_mean_numba(
+        codes: np.ndarray, vals: np.ndarray, n_groups: int, n_threads: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Compute the mean of each group and subtract it from the values of its rows.
+
+        Each thread accumulates the sums and counts of a contiguous chunk of rows in its own
+        buffers, which are then reduced, so that threads never write to the same memory.
+
+        :param codes: Group code of each row, lower than ``n_groups``.
+        :param vals: Value of each row.
+        :param n_groups: Number of group codes.
+        :param n_threads: Number of threads accumulating sums and counts.
+        :return: Mean of each group code and value of each row minus the mean of its group.
+        """
+        n_rows = len(vals)
+        chunk_size = (n_rows + n_threads - 1) // n_threads
+
+        sums = np.zeros((n_threads, n_groups))
+        counts = np.zeros((n_threads, n_groups), dtype=np.int64)
+        for thread in prange(n_threads):
+            for i in range(thread * chunk_size, min((thread + 1) * chunk_size, n_rows)):
+                sums[thread, codes[i]] += vals[i]
+                counts[thread, codes[i]] += 1
 
-    # Join the group means to the original DataFrame
-    df_with_means = df.join(group_means, on=group_col)
+        group_sums = sums.sum(axis=0)
+        group_counts = counts.sum(axis=0)
+        means = np.zeros(n_groups)
+        for group in range(n_groups):
+            if group_counts[group]:
+                means[group] = group_sums[group] / group_counts[group]
 
-    # Subtract the group mean from the original value column
-    return df_with_means.with_columns( (pl.col(val_col) - pl.col(mean_col)).alias(val_col) )
+        residuals = np.empty_like(vals)
+        for i in prange(n_rows):
+            residuals[i] = vals[i] - means[codes[i]]
 
+        return means, residuals
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """Scripts for alxn_test."""
 from .data_prep import prepare_data
+from .stocks_prep import prepare_stocks
 
-__all__: list[str] = ["prepare_data"]
+__all__: list[str] = ["prepare_data", "prepare_stocks"]
@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 """Script for data preparation."""
+import math
 import sys
 from pathlib import Path
 
 import click
-import pandas as pd
+import polars as pl
 from loguru import logger
-from sklearn import model_selection
 
 from alxn_test import CONFIG_DIR, DATA_DIR, SEED
 from alxn_test.settings import PreparationSettings
@@ -50,18 +50,19 @@ def prepare_data(config_path: Path, in_path: Path, out_train: Path, out_test: Pa
         )
         logger.debug("Settings loaded from {} file", config_path.absolute())
 
-        data = pd.read_csv(settings.in_path)
+        data = pl.scan_csv(settings.in_path).collect()
         logger.info("Raw data read from {} file", settings.in_path.absolute())
 
-        train, test = model_selection.train_test_split(
-            data, test_size=settings.test_size, random_state=SEED
-        )
+        # Shuffle and split as scikit-learn's train_test_split does, rounding the test size up
+        data = data.sample(fraction=1.0, shuffle=True, seed=SEED)
+        test_rows = math.ceil(len(data) * settings.test_size)
+        test, train = data.head(test_rows), data.slice(test_rows)
         logger.debug("Train and test data split")
 
-        train.to_parquet(settings.out_train)
+        train.write_parquet(settings.out_train, compression="zstd")
         logger.info("Train data stored in {} file", settings.out_train.absolute())
 
-        test.to_parquet(settings.out_test)
+        test.write_parquet(settings.out_test, compression="zstd")
         logger.info("Test data stored in {} file", settings.out_test.absolute())
 
     except Exception as exc:
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Script for S&P 500 stocks data preparation."""
+import sys
+from pathlib import Path
+
+import click
+from loguru import logger
+
+from alxn_test import DATA_DIR
+from alxn_test.api.data_preparation import prepare_data as prepare_stocks_data
+
+
+@click.command("prepare-stocks")
+@click.option(
+    "--in-path",
+    default=DATA_DIR / "all_stocks_5yr.csv",
+    type=click.Path(True, path_type=Path),
+    help="Path where raw stocks data is read from.",
+)
+@click.option(
+    "--out-path",
+    default=DATA_DIR / "all_stocks_5yr.prepared.parquet",
+    type=click.Path(path_type=Path),
+    help="Path where prepared stocks data served by the API is stored.",
+)
+@click.option(
+    "--knn-imputation",
+    is_flag=True,
+    help="Impute missing values with KNN instead of forward/backward filling them.",
+)
+def prepare_stocks(in_path: Path, out_path: Path, knn_imputation: bool) -> None:
+    """Prepare raw S&P 500 stocks data to be served by the API.
+
+    :param in_path: Path where raw stocks data is read from.
+    :param out_path: Path where prepared stocks data served by the API is stored.
+    :param knn_imputation: Whether to impute missing values with KNN.
+    """
+    try:
+        logger.info("Preparing stocks data")
+
+        data = prepare_stocks_data(in_path.absolute(), knn_imputation=knn_imputation)
+        logger.info("Raw data read and prepared from {} file", in_path.absolute())
+
+        data.write_parquet(out_path, compression="zstd", statistics=True)
+        logger.info("Prepared data stored in {} file", out_path.absolute())
+
+    except Exception:
+        logger.exception("Unexpected error")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    prepare_stocks()
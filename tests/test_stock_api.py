@@ -2,13 +2,24 @@
 
 import pytest
 from bs4 import BeautifulSoup
+from click.testing import CliRunner
 from fastapi.testclient import TestClient
 
 from alxn_test.api import app
+from alxn_test.api.stock_api import prepared_file
+from alxn_test.scripts import prepare_stocks
 
 client = TestClient(app)
 
 
+@pytest.fixture(scope="module", autouse=True)
+def _prepared_stocks() -> None:
+    """Build the prepared stocks data served by the API, unless it already exists."""
+    if not prepared_file.exists():
+        result = CliRunner().invoke(prepare_stocks)
+        assert result.exit_code == 0, result.output
+
+
 def extract_data_from_html(html_content: str) -> dict[str, str]:
     """Extract data from HTML content into a dictionary."""
     soup = BeautifulSoup(html_content, "html.parser")
@@ -38,6 +49,14 @@ def test_calculate_gains_invalid_date_format() -> None:
     assert "Invalid date format" in response.text
 
 
+@pytest.mark.parametrize("starting_date", ["20130208", "2013-W06-5"])
+def test_calculate_gains_non_strict_date_format(starting_date: str) -> None:
+    """Test calculation of gains with ISO 8601 dates not in the YYYY-MM-DD format."""
+    response = client.get(f"/ex2/gains?name=AAPL&starting_date={starting_date}&end_date=2018-02-07&investment=1000")
+    assert response.status_code == 400
+    assert "Invalid date format" in response.text
+
+
 def test_calculate_gains_end_date_before_start_date() -> None:
     """Test calculation of gains with end date before start date."""
     response = client.get("/ex2/gains?name=AAPL&starting_date=2018-02-07&end_date=2013-02-08&investment=1000")
@@ -59,6 +78,24 @@ def test_calculate_gains_invalid_date_range() -> None:
     assert "No data found for the specified company and date range" in response.text
 
 
+def test_calculate_gains_non_trading_day_boundaries() -> None:
+    """Test calculation of gains with a date range starting and ending on weekends."""
+    response = client.get("/ex2/gains?name=AAPL&starting_date=2013-02-09&end_date=2018-02-04&investment=1000")
+    assert response.status_code == 200
+    data = extract_data_from_html(response.text)
+    assert all(key in data for key in ["Starting Price", "Ending Price", "Gains/Losses"])
+
+
+def test_calculate_gains_not_modified() -> None:
+    """Test that a cached page is revalidated with its ETag without sending it again."""
+    url = "/ex2/gains?name=AAPL&starting_date=2013-02-08&end_date=2018-02-07&investment=1000"
+    etag = client.get(url).headers["ETag"]
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+
+
 @pytest.mark.parametrize("investment", [1000, 5000, 10000])
 def test_calculate_gains_different_investments(investment: float) -> None:
     """Test calculation of gains with different investment amounts."""
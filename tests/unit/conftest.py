@@ -1,2 +1,22 @@
 # -*- coding: utf-8 -*-
 """Fixtures for unit tests."""
+import polars as pl
+import pytest
+
+
+@pytest.fixture
+def group_df() -> pl.DataFrame:
+    """Values split in three groups, one of them with a single row."""
+    return pl.DataFrame({
+        "group_col": ["A", "A", "B", "B", "C"],
+        "val_col": [10, 20, 30, 40, 50]
+    })
+
+
+@pytest.fixture(params=["eager", "lazy"])
+def group_frame(
+    request: pytest.FixtureRequest, group_df: pl.DataFrame
+) -> pl.DataFrame | pl.LazyFrame:
+    """The grouped values as a DataFrame, which takes the array kernels, and as a LazyFrame,
+    which takes the Polars query."""  # noqa: D205, D209
+    return group_df.lazy() if request.param == "lazy" else group_df
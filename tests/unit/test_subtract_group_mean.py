@@ -1,31 +1,153 @@
-import polars as pl  # noqa: D100
+import numpy as np  # noqa: D100
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
 
-from alxn_test.processing.subtract_group_mean import subtract_group_mean
+from alxn_test.processing import subtract_group_mean as subtract_group_mean_module
+from alxn_test.processing.subtract_group_mean import (
+    subtract_group_mean,
+    subtract_group_mean_arrays,
+)
 
 
-def test_subtract_group_mean() -> None:
+def _collect(frame: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    """Collect a LazyFrame, leaving a DataFrame as it is."""
+    return frame.collect() if isinstance(frame, pl.LazyFrame) else frame
+
+
+def test_subtract_group_mean(group_frame: pl.DataFrame | pl.LazyFrame) -> None:
     """
     Tests the subtract_group_mean function by checking if it correctly subtracts 
     the mean of the grouped column and adds a new column with the group mean.
     """  # noqa: D212
-    df = pl.DataFrame({  # noqa: PD901
+    expected_df = pl.DataFrame({
         "group_col": ["A", "A", "B", "B", "C"],
-        "val_col": [10, 20, 30, 40, 50]
+        "val_col_mean_by_group_col": [15.0, 15.0, 35.0, 35.0, 50.0],
+        "val_col": [-5.0, 5.0, -5.0, 5.0, 0.0],
     })
 
+    # Apply the function
+    result_df = _collect(subtract_group_mean(group_frame, "group_col", "val_col"))
+
+    # Compare the DataFrames
+    assert result_df.equals(expected_df)
+
+
+def test_subtract_group_mean_lazy(group_df: pl.DataFrame) -> None:
+    """A LazyFrame input stays lazy and matches the DataFrame result."""
+    result_lf = subtract_group_mean(group_df.lazy(), "group_col", "val_col")
+
+    assert isinstance(result_lf, pl.LazyFrame)
+    assert result_lf.collect().equals(subtract_group_mean(group_df, "group_col", "val_col"))
+
+
+def test_subtract_group_mean_float32(group_frame: pl.DataFrame | pl.LazyFrame) -> None:
+    """Means and adjusted values are computed in the requested dtype."""
+    result_df = _collect(
+        subtract_group_mean(group_frame, "group_col", "val_col", dtype=pl.Float32)
+    )
+
+    assert result_df.schema["val_col_mean_by_group_col"] == pl.Float32
+    assert result_df.schema["val_col"] == pl.Float32
+    assert result_df["val_col"].to_list() == [-5.0, 5.0, -5.0, 5.0, 0.0]
+
+
+def test_subtract_group_mean_non_float_dtype(group_frame: pl.DataFrame | pl.LazyFrame) -> None:
+    """Values cannot be cast to a dtype that would truncate the means."""
+    with pytest.raises(ValueError, match="float type"):
+        subtract_group_mean(group_frame, "group_col", "val_col", dtype=pl.Int64)
+
+
+def test_subtract_group_mean_missing_column(group_frame: pl.DataFrame | pl.LazyFrame) -> None:
+    """A missing value column is reported as such by both the eager and lazy paths."""
+    with pytest.raises(pl.exceptions.ColumnNotFoundError):
+        _collect(subtract_group_mean(group_frame, "group_col", "missing_col"))
+
+
+def test_subtract_group_mean_streaming(
+    group_df: pl.DataFrame, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """An explicit streaming request is collected with the streaming engine."""
+    engines = []
+    collect = pl.LazyFrame.collect
+
+    def spy_collect(self: pl.LazyFrame, *args: object, **kwargs: object) -> pl.DataFrame:
+        engines.append(kwargs.get("engine"))
+        return collect(self, *args, **kwargs)
+
+    monkeypatch.setattr(pl.LazyFrame, "collect", spy_collect)
+    result_df = subtract_group_mean(group_df, "group_col", "val_col", streaming=True)
+
+    assert engines == ["streaming"]
+    assert result_df.equals(subtract_group_mean(group_df.lazy(), "group_col", "val_col").collect())
+
+
+def test_subtract_group_mean_without_mean(group_frame: pl.DataFrame | pl.LazyFrame) -> None:
+    """Only the adjusted values are returned when the mean column is not kept."""
     expected_df = pl.DataFrame({
         "group_col": ["A", "A", "B", "B", "C"],
-        "val_col_mean_by_group_col": [15.0, 15.0, 35.0, 35.0, 50.0],
         "val_col": [-5.0, 5.0, -5.0, 5.0, 0.0],
     })
 
-    # Apply the function
+    result_df = _collect(
+        subtract_group_mean(group_frame, "group_col", "val_col", keep_mean=False)
+    )
+
+    assert result_df.equals(expected_df)
+
+
+def test_subtract_group_mean_sorted(group_df: pl.DataFrame) -> None:
+    """Data flagged as sorted by group is reduced by segments to the same result."""
+    sorted_df = group_df.with_columns(pl.col("group_col").set_sorted())
+
+    result_df = subtract_group_mean(sorted_df, "group_col", "val_col")
+
+    assert result_df.equals(subtract_group_mean(sorted_df.lazy(), "group_col", "val_col").collect())
+
+
+def test_subtract_group_mean_numba(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Unsorted enum groups of large frames are reduced by the numba kernel to the same result."""
+    pytest.importorskip("numba")
+
+    # Treat every frame as large, and record the calls to the numba kernel
+    monkeypatch.setattr(subtract_group_mean_module, "_SMALL_FRAME_ROWS", 0)
+    calls = []
+    numba_kernel = subtract_group_mean_module._subtract_group_mean_numba
+
+    def spy_kernel(*args: object) -> tuple[np.ndarray, np.ndarray]:
+        calls.append(args)
+        return numba_kernel(*args)
+
+    monkeypatch.setattr(subtract_group_mean_module, "_subtract_group_mean_numba", spy_kernel)
+    df = pl.DataFrame({  # noqa: PD901
+        "group_col": pl.Series(["A", "B", "C", "A"] * 5, dtype=pl.Enum(["A", "B", "C"])),
+        "val_col": range(20),
+    })
+
     result_df = subtract_group_mean(df, "group_col", "val_col")
 
-    # Ensure the column order is the same before comparing
-    result_df = result_df.select(["group_col", "val_col_mean_by_group_col", "val_col"])
+    assert len(calls) == 1
+    assert_frame_equal(
+        result_df, subtract_group_mean(df.lazy(), "group_col", "val_col").collect()
+    )
 
 
-    # Compare the DataFrames
-    assert result_df.equals(expected_df)
+def test_subtract_group_mean_arrays() -> None:
+    """Group means and adjusted values are computed on sorted, unsorted and integer arrays."""
+    group_codes = np.array([0, 0, 2, 2, 3])
+    vals = np.array([10.0, 20.0, 30.0, 40.0, 50.0])
+
+    means, residuals = subtract_group_mean_arrays(group_codes, vals)
+
+    assert means.tolist() == [15.0, 0.0, 35.0, 50.0]
+    assert residuals.tolist() == [-5.0, 5.0, -5.0, 5.0, 0.0]
+
+    means, residuals = subtract_group_mean_arrays(group_codes[::-1], vals)
+
+    assert means.tolist() == [45.0, 0.0, 25.0, 10.0]
+    assert residuals.tolist() == [0.0, -5.0, 5.0, -5.0, 5.0]
+
+    means, residuals = subtract_group_mean_arrays(np.array([1, 0, 1]), np.array([1, 2, 4]))
 
+    assert means.tolist() == [2.0, 2.5]
+    assert residuals.tolist() == [-1.5, 0.0, 1.5]